@@ -1,15 +1,119 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import orjson
 import pandas as pd
-import io
+import asyncio
+import re
 import numpy as np
+import os
 from datetime import datetime
 try:
-    from solver_engine import run_solver 
+    import polars as pl
 except ImportError:
-    from .solver_engine import run_solver
+    pl = None
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = pacsv = None
+try:
+    from solver_engine import run_solver, normalize_name
+except ImportError:
+    from .solver_engine import run_solver, normalize_name
+
+XLSX_READ_OPTS = {"read_only": True, "data_only": True, "keep_links": False}
+USE_POLARS = pl is not None and os.environ.get("USE_POLARS_INGEST", "").lower() in ("1", "true", "yes")
+
+def to_pandas(df):
+    """Hands a Polars frame to pandas via Arrow, keeping Arrow-backed columns."""
+    return df.to_arrow().to_pandas(types_mapper=pd.ArrowDtype)
+
+def read_excel_sheets(source, filename):
+    """Reads every sheet of a workbook (file-like) into a dict of pandas DataFrames."""
+    if USE_POLARS:
+        # calamine needs bytes or a path, not a file object
+        return {name: to_pandas(df) for name, df in pl.read_excel(source.read(), sheet_id=0).items()}
+    if filename.endswith('.xlsx'):
+        # Stream rows lazily; skip formulas and cached external-link sheets
+        return pd.read_excel(source, sheet_name=None, engine="openpyxl", engine_kwargs=XLSX_READ_OPTS)
+    return pd.read_excel(source, sheet_name=None)
+
+def read_csv(source):
+    """Reads a CSV upload (file-like) into a pandas DataFrame."""
+    if USE_POLARS:
+        return to_pandas(pl.read_csv(source))
+    if pacsv is not None:
+        # Multithreaded parse straight into Arrow buffers; numeric columns reach pandas without a copy.
+        # Empty fields become null as in pandas, so rows of bare separators still drop as blank
+        return pacsv.read_csv(source, read_options=pacsv.ReadOptions(use_threads=True),
+                              convert_options=pacsv.ConvertOptions(strings_can_be_null=True)).to_pandas(types_mapper=pd.ArrowDtype)
+    return pd.read_csv(source)
+
+def orjson_default(obj):
+    """Serializes the pandas scalars orjson does not know natively."""
+    if isinstance(obj, pd.Timestamp): return obj.isoformat()
+    if obj is pd.NA or obj is pd.NaT: return None
+    raise TypeError
 
-app = FastAPI()
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered by orjson in one C pass (NumPy scalars/arrays, NaN -> null)."""
+    def render(self, content):
+        return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+def to_records(df):
+    """Converts a DataFrame to JSON-ready row dicts, with missing values as None."""
+    if df is None: return []
+    if pa is not None:
+        try:
+            # Arrow maps NaN to null natively, so no full-frame replace pass is needed
+            return pa.Table.from_pandas(df, preserve_index=False).to_pylist()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass  # mixed-type object column; fall back to pandas
+    return df.replace({np.nan: None}).to_dict('records')
+
+SHEET_MAPPING = {
+    'demand': ['demand', 'sales'], 
+    'bom': ['bom', 'bill', 'structure'], 
+    'resource_routing': ['resourcerouting', 'resource_routing'],
+    'routing': ['routing', 'operations'], 
+    'supplier_master': ['suppliermaster', 'supplier_master', 'vendor'],
+    'items': ['item', 'article', 'product'], 
+    'supplies': ['supplies', 'stock', 'inventory']
+}
+
+# One alternation over every token (longest first, so 'resourcerouting' wins over 'routing')
+TOKEN_TO_KEY = {normalize_name(p): key for key, patterns in SHEET_MAPPING.items() for p in patterns}
+KEY_PRIORITY = {key: i for i, key in enumerate(SHEET_MAPPING)}
+SHEET_RE = re.compile("|".join(sorted(map(re.escape, TOKEN_TO_KEY), key=len, reverse=True)))
+
+def match_key(name):
+    """Maps a sheet or file name to its data key, or None if unrecognised."""
+    hits = SHEET_RE.findall(normalize_name(name))
+    # Several tokens can match ('productstructure'); the earlier mapping key wins
+    return min((TOKEN_TO_KEY[h] for h in hits), key=KEY_PRIORITY.get, default=None)
+
+def parse_upload(filename, source):
+    """Parses one upload into a list of (data key, DataFrame) pairs."""
+    filename = filename.lower()
+    if filename.endswith(('.xlsx', '.xls')):
+        sheets = []
+        for sheet_name, df in read_excel_sheets(source, filename).items():
+            matched_key = match_key(sheet_name)
+            if matched_key:
+                sheets.append((matched_key, df.dropna(how='all').reset_index(drop=True)))
+        return sheets
+    matched_key = match_key(filename)
+    if matched_key:
+        return [(matched_key, read_csv(source).dropna(how='all'))]
+    return []
+
+async def ingest(file):
+    """Parses an upload off the event loop, straight from its spooled temp file."""
+    await file.seek(0)
+    return await asyncio.to_thread(parse_upload, file.filename, file.file)
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,52 +131,34 @@ async def solve(
     files: list[UploadFile] = File(...)
 ):
     try:
-        data = {k: None for k in ['demand', 'items', 'bom', 'routing', 'resource_routing', 'supplies', 'supplier_master']}
-        mapping = {
-            'demand': ['demand', 'sales'], 
-            'bom': ['bom', 'bill', 'structure'], 
-            'resource_routing': ['resourcerouting', 'resource_routing'],
-            'routing': ['routing', 'operations'], 
-            'supplier_master': ['suppliermaster', 'supplier_master', 'vendor'],
-            'items': ['item', 'article', 'product'], 
-            'supplies': ['supplies', 'stock', 'inventory']
-        }
-
-        for file in files:
-            contents = await file.read()
-            filename = file.filename.lower()
-            if filename.endswith(('.xlsx', '.xls')):
-                xls = pd.read_excel(io.BytesIO(contents), sheet_name=None)
-                for sheet_name, df in xls.items():
-                    clean_sheet = sheet_name.lower().replace(" ", "").replace("_", "").replace("-", "")
-                    matched_key = None
-                    for key, patterns in mapping.items():
-                        if any(p in clean_sheet for p in patterns):
-                            matched_key = key
-                            break
-                    if matched_key:
-                        data[matched_key] = df.dropna(how='all').reset_index(drop=True)
-            else:
-                clean_filename = filename.replace(" ", "").replace("_", "").replace("-", "")
-                for key, patterns in mapping.items():
-                    if any(p in clean_filename for p in patterns):
-                        df = pd.read_csv(io.BytesIO(contents))
-                        data[key] = df.dropna(how='all')
-                        break
+        data = {k: None for k in SHEET_MAPPING}
+        parsed = await asyncio.gather(*[ingest(file) for file in files])
+        for sheets in parsed:
+            for key, df in sheets:
+                data[key] = df
 
         sim_start = pd.to_datetime(start_date).date() if start_date else datetime(2025, 12, 1).date()
         results = run_solver(data, horizon, sim_start, is_constrained, build_ahead)
         
         results["raw_data"] = {
-            "bom": data['bom'].replace({np.nan: None}).to_dict('records') if data['bom'] is not None else [],
-            "supplier_master": data['supplier_master'].replace({np.nan: None}).to_dict('records') if data['supplier_master'] is not None else [],
-            "items": data['items'].replace({np.nan: None}).to_dict('records') if data['items'] is not None else []
+            "bom": to_records(data['bom']),
+            "supplier_master": to_records(data['supplier_master']),
+            "items": to_records(data['items'])
         }
-        return results
+        # Returning the response directly skips FastAPI's jsonable_encoder walk over the MRP payload
+        return ORJSONResponse(results)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=max(2, (os.cpu_count() or 2) // 2),
+    )
\ No newline at end of file
@@ -1,24 +1,81 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from math import ceil
+from collections import defaultdict, namedtuple
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Fallback when numba is not installed: run the plain Python function."""
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda f: f
+
+_NAME_STRIP = str.maketrans("", "", " _-")
+ID_TOKENS = ('id', 'item', 'child', 'parent', 'resource')
+
+# MRP buckets are stored field-major: mrp[field, item_row, date_idx]
+MRP_FIELDS = ('starting_stock', 'inflow_supplier', 'inflow_wip', 'inflow_onhand', 'inflow_fresh',
+              'outflow_dep', 'outflow_direct', 'ending_stock', 'shortage')
+(STARTING_STOCK, INFLOW_SUPPLIER, INFLOW_WIP, INFLOW_ONHAND, INFLOW_FRESH,
+ OUTFLOW_DEP, OUTFLOW_DIRECT, ENDING_STOCK, SHORTAGE) = range(len(MRP_FIELDS))
+
+# Per-item planning data; bom_key / sup_key index the BOM and supplier CSR offsets (None if absent)
+ItemMeta = namedtuple('ItemMeta', 'is_make make_sec lt_buy res_id hrs_per_unit bom_key sup_key')
+
+def normalize_name(name):
+    """Lowercases a column/sheet name and strips spaces, underscores and hyphens."""
+    return str(name).lower().translate(_NAME_STRIP)
 
 def normalize_df(df):
     """Standardizes column names and removes empty rows."""
     if df is None: return None
-    df_copy = df.copy()
-    df_copy.columns = [str(c).lower().replace(" ", "").replace("_", "").replace("-", "") for c in df_copy.columns]
-    return df_copy.dropna(how='all').reset_index(drop=True)
+    # set_axis/dropna hand back new frames, so the caller's data is left untouched without a full copy
+    return df.set_axis([normalize_name(c) for c in df.columns], axis=1).dropna(how='all').reset_index(drop=True)
 
 def get_col(df, *options):
     """Finds a column name in a dataframe based on multiple possible matches."""
     if df is None: return None
-    norm_options = [o.lower().replace(" ", "").replace("_", "").replace("-", "") for o in options]
+    norm_options = set(map(normalize_name, options))
     for col in df.columns:
-        normalized_col = str(col).lower().replace(" ", "").replace("_", "").replace("-", "")
-        if normalized_col in norm_options:
+        if normalize_name(col) in norm_options:
             return col
     return None
 
+def numeric_col(df, cols, default=0):
+    """Coerces one column (or the row-sum of several) to a float array, missing -> default."""
+    if isinstance(cols, str):
+        if cols not in df.columns: return np.full(len(df), float(default))
+        return pd.to_numeric(df[cols], errors='coerce').fillna(default).to_numpy(dtype=np.float64)
+    if not cols: return np.zeros(len(df))
+    return df[cols].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=np.float64).sum(axis=1)
+
+def as_numbers(arr):
+    """Lists a float array as Python numbers, keeping integral values as ints (as read per cell)."""
+    return [int(v) if v.is_integer() else v for v in arr.tolist()]
+
+def first_rows(df, key):
+    """Returns the first row per key value (keeping row order), or None if there is no key column."""
+    if df is None or key not in df.columns: return None
+    return df.drop_duplicates(key)
+
+def csr_index(keys):
+    """Groups row positions by key in CSR form.
+
+    Returns ({key: k}, order, offsets): the rows for key k are
+    order[offsets[k]:offsets[k + 1]], in their original relative order.
+    """
+    codes, uniques = pd.factorize(keys)
+    order = np.argsort(codes, kind='stable')
+    offsets = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {k: i for i, k in enumerate(uniques)}, order, offsets.tolist()
+
+def str_col(df, col, default):
+    """Returns a column as a list of strings; `default` (a value or a list) if it is missing."""
+    if col not in df.columns: return default if isinstance(default, list) else [default] * len(df)
+    return df[col].astype(str).tolist()
+
+@njit(cache=True)
 def apply_lot_sizing(qty, lot_size, lot_inc):
     """Applies lot size and increment logic to a requirement."""
     if lot_size <= 0:
@@ -26,11 +83,39 @@ def apply_lot_sizing(qty, lot_size, lot_inc):
     if qty <= lot_size:
         return lot_size
     if lot_inc > 0:
-        extra = qty - lot_size
-        num_increments = np.ceil(extra / lot_inc)
-        return lot_size + (num_increments * lot_inc)
+        return lot_size + ceil((qty - lot_size) / lot_inc) * lot_inc
     return qty
 
+@njit(cache=True)
+def find_capacity_slot(cap, start_idx, needed, max_lookback):
+    """Returns the latest day in [start_idx - max_lookback, start_idx] with cap >= needed, or -1."""
+    for idx in range(min(start_idx, cap.shape[0] - 1), max(start_idx - max_lookback, 0) - 1, -1):
+        if cap[idx] >= needed:
+            return idx
+    return -1
+
+@njit(cache=True)
+def book_supplier_days(cap, due_day, lookback, target, unmet, lot_size, lot_inc, days, qtys):
+    """Books lot-sized orders on the open days of [due_day - lookback + 1, due_day], latest first.
+
+    Decrements cap in place, writes each booking to days/qtys and returns the number of bookings.
+    """
+    n, allocated = 0, 0.0
+    for idx in range(min(due_day, cap.shape[0] - 1), max(due_day - lookback + 1, 0) - 1, -1):
+        if not cap[idx] > 0: continue
+        base_req = min(target - allocated, unmet)
+        if base_req <= 0: break
+        final_qty = min(apply_lot_sizing(base_req, lot_size, lot_inc), cap[idx])
+        if final_qty > 0:
+            cap[idx] -= final_qty
+            satisfied = min(final_qty, unmet)
+            unmet -= satisfied
+            allocated += satisfied
+            days[n], qtys[n] = idx, final_qty
+            n += 1
+        if allocated >= target or unmet <= 0: break
+    return n
+
 def run_solver(data, horizon, start_date, is_constrained, build_ahead):
     """
     Engine to calculate MRP with Lot Sizing and Procurement Financial logic.
@@ -56,9 +141,10 @@ def run_solver(data, horizon, start_date, is_constrained, build_ahead):
     # Standardize IDs
     for df in [items, bom, routing_master, res_routing, supplies, supplier_master, demand]:
         if df is not None:
-            for col in df.columns:
-                if any(x in col for x in ['id', 'item', 'child', 'parent', 'resource']):
-                    df[col] = df[col].astype(str).str.strip().str.upper()
+            id_cols = [c for c in df.columns if any(t in c for t in ID_TOKENS)]
+            if id_cols:
+                # Categorical IDs: grouping and factorizing work on integer codes
+                df[id_cols] = df[id_cols].astype(str).apply(lambda col: col.str.strip().str.upper()).astype('category')
 
     transient_stock = {}
     initial_onhand, initial_wip, initial_supplier_stock = {}, {}, {}
@@ -66,76 +152,169 @@ def run_solver(data, horizon, start_date, is_constrained, build_ahead):
     # 2. Initialize Inventory
     item_col = get_col(supplies, "itemid", "itemcode", "item")
     if item_col and supplies is not None:
-        for _, row in supplies.iterrows():
-            item_id = str(row[item_col])
-            oh = pd.to_numeric(row.get('fg', 0), errors='coerce') or 0
-            wp = pd.to_numeric(row.get('wip', 0), errors='coerce') or 0
-            sup = pd.to_numeric(row.get('supplier', 0), errors='coerce') or 0
-            other = sum([pd.to_numeric(row[c], errors='coerce') or 0 for c in supplies.columns if 'rework' in str(c).lower()])
-            
-            initial_onhand[item_id] = oh + other
-            initial_wip[item_id] = wp
-            initial_supplier_stock[item_id] = sup
-            transient_stock[item_id] = initial_onhand[item_id] + initial_wip[item_id] + initial_supplier_stock[item_id]
+        ids = supplies[item_col].astype(str).to_numpy()
+        rework_cols = [c for c in supplies.columns if 'rework' in c]
+        oh = numeric_col(supplies, 'fg') + numeric_col(supplies, rework_cols)
+        wp = numeric_col(supplies, 'wip')
+        sup = numeric_col(supplies, 'supplier')
+        initial_onhand = dict(zip(ids, as_numbers(oh)))
+        initial_wip = dict(zip(ids, as_numbers(wp)))
+        initial_supplier_stock = dict(zip(ids, as_numbers(sup)))
+        transient_stock = dict(zip(ids, as_numbers(oh + wp + sup)))
     
     # 3. Initialize Capacities
     dates_list = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(horizon + 61)]
     
     transient_resource_capacity = {}
     if res_routing is not None:
-        for _, row in res_routing.iterrows():
-            res_id = str(row['resourceid'])
+        col = {c: i for i, c in enumerate(res_routing.columns)}
+        for row in res_routing.itertuples(index=False, name=None):
+            res_id = str(row[col['resourceid']])
             if res_id not in transient_resource_capacity:
-                daily_hours = (pd.to_numeric(row.get('dailycapacity', 0)) or 0) * (pd.to_numeric(row.get('noofmachines', 1)) or 1)
-                transient_resource_capacity[res_id] = {d: daily_hours for d in dates_list}
+                hours = row[col['dailycapacity']] if 'dailycapacity' in col else 0
+                machines = row[col['noofmachines']] if 'noofmachines' in col else 1
+                daily_hours = (pd.to_numeric(hours) or 0) * (pd.to_numeric(machines) or 1)
+                transient_resource_capacity[res_id] = np.full(len(dates_list), daily_hours, dtype=np.float64)
 
     transient_supplier_capacity = {}
     if supplier_master is not None:
-        for _, row in supplier_master.iterrows():
-            s_id = str(row.get('supplierid', row.get('suppliername', 'Unknown')))
-            item_id = str(row['itemid'])
-            cap_key = f"{s_id}_{item_id}"
+        s_ids = str_col(supplier_master, 'supplierid', str_col(supplier_master, 'suppliername', 'Unknown'))
+        caps = supplier_master['suppliercapacityperday'] if 'suppliercapacityperday' in supplier_master.columns else [999999] * len(s_ids)
+        for cap_key, cap in zip(zip(s_ids, str_col(supplier_master, 'itemid', None)), caps):
             if cap_key not in transient_supplier_capacity:
-                daily_qty = pd.to_numeric(row.get('suppliercapacityperday', 999999), errors='coerce') or 999999
-                transient_supplier_capacity[cap_key] = {d: daily_qty for d in dates_list}
+                daily_qty = pd.to_numeric(cap, errors='coerce')
+                if pd.isna(daily_qty) or daily_qty == 0: daily_qty = 999999  # blank means uncapped
+                transient_supplier_capacity[cap_key] = np.full(len(dates_list), daily_qty, dtype=np.float64)
 
     # 4. Sort Demand
     if demand is not None:
         demand['priority'] = pd.to_numeric(demand.get('demandpriority', 999), errors='coerce')
         demand['date_dt'] = pd.to_datetime(demand['duedate'])
         demand['duedate_clean'] = demand['date_dt'].dt.strftime('%Y-%m-%d')
+        demand['due_day'] = (demand['date_dt'].dt.normalize() - pd.Timestamp(start_date)).dt.days
         sorted_demand = demand.sort_values(by=['priority', 'date_dt'])
     else:
         sorted_demand = pd.DataFrame()
 
-    planned_orders, demand_trace, mrp_plan = [], [], {} 
+    # Planned orders are appended as (item, qty, type, start_day, finish_day, res, lt_days, supplier, rate, buyer)
+    # tuples in the hot path and expanded to dicts by order_record() at the end
+    planned_orders, demand_trace = [], []
+    plan_dates = dates_list[:horizon+1]
+    item_index = {}
 
     def init_mrp(item_id):
-        if item_id not in mrp_plan:
-            mrp_plan[item_id] = {d: {
-                'starting_stock': 0, 'inflow_supplier': 0, 'inflow_wip': 0, 
-                'inflow_onhand': 0, 'inflow_fresh': 0, 'outflow_dep': 0, 
-                'outflow_direct': 0, 'ending_stock': 0, 'shortage': 0
-            } for d in dates_list[:horizon+1]}
-            first_date = dates_list[0]
-            mrp_plan[item_id][first_date]['inflow_onhand'] = initial_onhand.get(item_id, 0)
-            mrp_plan[item_id][first_date]['inflow_wip'] = initial_wip.get(item_id, 0)
-            mrp_plan[item_id][first_date]['inflow_supplier'] = initial_supplier_stock.get(item_id, 0)
-
-    def resolve(item_id, qty, due_date_str, steps, log_list, is_direct=False, depth=0):
+        nonlocal mrp
+        row = item_index.get(item_id)
+        if row is None:
+            row = item_index[item_id] = len(item_index)
+            if row == mrp.shape[1]:  # only if the pre-sizing below missed an item
+                mrp = np.concatenate([mrp, np.zeros_like(mrp)], axis=1)
+            mrp[INFLOW_ONHAND, row, 0] = initial_onhand.get(item_id, 0)
+            mrp[INFLOW_WIP, row, 0] = initial_wip.get(item_id, 0)
+            mrp[INFLOW_SUPPLIER, row, 0] = initial_supplier_stock.get(item_id, 0)
+        return row
+
+    # Routing master data as typed scalars, coerced once instead of per resolve call (first row wins)
+    cycle_by_item = {}
+    routing_rows = first_rows(routing_master, 'item')
+    if routing_rows is not None:
+        cycle_by_item = dict(zip(str_col(routing_rows, 'item', ''), numeric_col(routing_rows, 'cycletime', 0).tolist()))
+
+    # item -> (resource id, resource hours per unit); consumption >= 1 is given in seconds
+    res_by_item = {}
+    res_rows = first_rows(res_routing, 'item')
+    if res_rows is not None:
+        cons = numeric_col(res_rows, 'capacityconsumedper', 1)
+        res_by_item = dict(zip(str_col(res_rows, 'item', ''),
+                               zip(str_col(res_rows, 'resourceid', ''), np.where(cons >= 1, cons / 3600, cons).tolist())))
+
+    # BOM in CSR form: children of parent p are bom_child[bom_offsets[p]:bom_offsets[p + 1]]
+    bom_index, bom_offsets = {}, [0]
+    if bom is not None and 'parentid' in bom.columns:
+        bom_index, order, bom_offsets = csr_index(bom['parentid'])
+        bom_child = np.asarray(str_col(bom, 'childid', ''), dtype=object)[order].tolist()
+        bom_qty = numeric_col(bom, 'qtyper', 1)[order].tolist()
+
+    # Suppliers in CSR form, share-sorted within each item
+    sup_index, sup_offsets = {}, [0]
+    if supplier_master is not None and 'itemid' in supplier_master.columns:
+        sups = supplier_master.sort_values(by='sharepercent', ascending=False, kind='stable')
+        sup_index, order, sup_offsets = csr_index(sups['itemid'])
+        sups = sups.iloc[order]
+        sup_ids = str_col(sups, 'supplierid', str_col(sups, 'suppliername', 'Unknown'))
+        sup_names = str_col(sups, 'suppliername', sup_ids)
+        sup_share = numeric_col(sups, 'sharepercent', 0).tolist()  # blank share allocates nothing
+        sup_lt = numeric_col(sups, 'leadtimedays', 7).astype(int).tolist()
+        sup_lot_size = numeric_col(sups, 'supplierlotsize').tolist()
+        sup_lot_inc = numeric_col(sups, 'supplierlotincrement').tolist()
+        sup_rate = numeric_col(sups, 'rateperunit').tolist()
+        sup_buyer = str_col(sups, 'buyercode', 'N/A')
+
+    # One ItemMeta per item, so resolve() reads fields instead of probing several tables
+    item_meta = {}
+    item_rows = first_rows(items, 'itemid')
+    if item_rows is not None:
+        lt_make_col = 'leadtimemakeseconds' if 'leadtimemakeseconds' in item_rows.columns else 'leadtimemake'
+        for item_id, mb, lt_make, lt_buy in zip(str_col(item_rows, 'itemid', ''), str_col(item_rows, 'makebuy', 'buy'),
+                                                numeric_col(item_rows, lt_make_col, 0).tolist(),
+                                                numeric_col(item_rows, 'leadtimebuy', 7).astype(int).tolist()):
+            mb = mb.lower()
+            res_id, hrs_per_unit = res_by_item.get(item_id, (None, 0.0))
+            # Make time per unit: the routing cycle time, else the item's make lead time
+            item_meta[item_id] = ItemMeta('make' in mb or 'both' in mb, cycle_by_item.get(item_id, 0) or lt_make, lt_buy,
+                                          res_id, hrs_per_unit, bom_index.get(item_id), sup_index.get(item_id))
+
+    # Make items whose plan is not additive in quantity: a constrained order must fit one resource
+    # day whole, and make lead time grows with the quantity. Their requirements are never merged.
+    unmerged_items = {i for i, m in item_meta.items()
+                      if m.is_make and (m.make_sec > 0 or (is_constrained and m.res_id is not None))}
+
+    # Pre-size the MRP array: resolve() only touches demand items and their BOM descendants
+    reachable = set(sorted_demand['itemid'].astype(str).str.strip().str.upper()) if 'itemid' in sorted_demand.columns else set()
+    frontier = list(reachable)
+    while frontier:
+        p = bom_index.get(frontier.pop())
+        if p is None: continue
+        for c_id in bom_child[bom_offsets[p]:bom_offsets[p + 1]]:
+            if c_id not in reachable:
+                reachable.add(c_id)
+                frontier.append(c_id)
+    mrp = np.zeros((len(MRP_FIELDS), max(len(reachable), 1), len(plan_dates)))
+
+    # Supplier bookings per call, filled by book_supplier_days (at most one per lookback day)
+    lookback = 15 if build_ahead else 1
+    book_days, book_qtys = np.empty(lookback, dtype=np.int64), np.empty(lookback)
+
+    def day_str(day):
+        """Formats a day offset from start_date as YYYY-MM-DD."""
+        if 0 <= day < len(dates_list): return dates_list[day]
+        return (start_date + timedelta(days=day)).strftime('%Y-%m-%d')
+
+    def order_record(i, order):
+        """Expands a planned-order tuple into its response dict."""
+        item_id, qty, kind, start_day, finish_day, res_id, lt_days, supplier, rate, buyer_code = order
+        rec = {"id": f"{'PO' if kind == 'Production' else 'PUR'}-{item_id}-{i}", "item": item_id, "qty": round(qty, 4),
+               "type": kind, "start": day_str(start_day), "finish": day_str(finish_day)}
+        if res_id is not None: rec["res"] = res_id
+        rec["lt_days"], rec["supplier"] = lt_days, supplier
+        if kind == "Purchase":
+            rec.update(rate=rate, total_cost=round(qty * rate, 2), buyer_code=buyer_code)
+        return rec
+
+    def resolve(item_id, qty, due_day, steps, is_direct=False):
+        """Nets, schedules and procures one requirement; returns its BOM child requirements."""
         item_id = item_id.strip().upper()
-        init_mrp(item_id)
-        if due_date_str in mrp_plan[item_id]:
-            if is_direct: mrp_plan[item_id][due_date_str]['outflow_direct'] += qty
-            else: mrp_plan[item_id][due_date_str]['outflow_dep'] += qty
+        row = init_mrp(item_id)
+        due_idx = due_day if 0 <= due_day < len(plan_dates) else None
+        if due_idx is not None:
+            mrp[OUTFLOW_DIRECT if is_direct else OUTFLOW_DEP, row, due_idx] += qty
         
-        item_info = items[items['itemid'] == item_id] if items is not None else pd.DataFrame()
-        if item_info.empty:
+        meta = item_meta.get(item_id)
+        if meta is None:
             steps.append({"action": "Infeasible", "reason": "Missing Master Data", "item": item_id})
-            return qty
+            return ()
         
-        item_row = item_info.iloc[0]
-        unmet = qty
+        unmet, children = qty, ()
         
         # Stock Consumption
         stock = transient_stock.get(item_id, 0)
@@ -145,86 +324,54 @@ def run_solver(data, horizon, start_date, is_constrained, build_ahead):
             unmet -= consumed
             steps.append({"action": "Stock", "msg": f"Consumed {round(consumed, 4)} units", "qty": round(consumed, 4), "item": item_id})
         
-        if unmet <= 0: return 0
+        if unmet <= 0: return ()
 
-        mb_raw = str(item_row.get('makebuy', 'buy')).lower()
-        is_make = 'make' in mb_raw or 'both' in mb_raw
-        
-        if is_make:
+        if meta.is_make:
             # PRODUCTION LOGIC
-            base_sec = 0
-            if routing_master is not None:
-                item_routing = routing_master[routing_master['item'] == item_id]
-                if not item_routing.empty:
-                    base_sec = pd.to_numeric(item_routing.iloc[0].get('cycletime', 0), errors='coerce') or 0
-            if base_sec == 0:
-                base_sec = pd.to_numeric(item_row.get('leadtimemakeseconds', item_row.get('leadtimemake', 0)), errors='coerce') or 0
-
-            lt_days = max(0, int((unmet * base_sec) / 86400))
-            req_start_dt = datetime.strptime(due_date_str, '%Y-%m-%d') - timedelta(days=lt_days)
-            req_start_str = req_start_dt.strftime('%Y-%m-%d')
-
-            if req_start_dt.date() < start_date:
-                steps.append({"action": "Infeasible", "reason": "RCA Lead Time Violation", "item": item_id, "needed_start": req_start_str})
-
-            comps = bom[bom['parentid'] == item_id] if bom is not None else pd.DataFrame()
-            if not comps.empty:
-                for _, c_row in comps.iterrows():
-                    c_id = str(c_row['childid'])
-                    c_qty = unmet * pd.to_numeric(c_row.get('qtyper', 1))
-                    resolve(c_id, c_qty, req_start_str, steps, log_list, False, depth + 1)
-
-            routing = res_routing[res_routing['item'] == item_id] if res_routing is not None else pd.DataFrame()
-            if not routing.empty and is_constrained:
-                route_row = routing.iloc[0]
-                res_id = str(route_row['resourceid'])
-                cons_raw = pd.to_numeric(route_row.get('capacityconsumedper', 1))
-                needed_cap_hrs = (unmet * cons_raw) / 3600 if cons_raw >= 1 else unmet * cons_raw
+            lt_days = max(0, int((unmet * meta.make_sec) / 86400))
+            req_start_day = due_day - lt_days
+
+            if req_start_day < 0:
+                steps.append({"action": "Infeasible", "reason": "RCA Lead Time Violation", "item": item_id, "needed_start": day_str(req_start_day)})
+
+            p = meta.bom_key
+            if p is not None:
+                children = [(bom_child[c], unmet * bom_qty[c], req_start_day) for c in range(bom_offsets[p], bom_offsets[p + 1])]
+
+            if meta.res_id is not None and is_constrained:
+                res_id = meta.res_id
+                needed_cap_hrs = unmet * meta.hrs_per_unit
                 
-                found_capacity = False
                 max_lookback = 15 if build_ahead else 0
-                for lb in range(0, max_lookback + 1):
-                    check_dt = req_start_dt - timedelta(days=lb)
-                    if check_dt.date() < start_date: break
-                    d_str = check_dt.strftime('%Y-%m-%d')
-                    avail = transient_resource_capacity.get(res_id, {}).get(d_str, 0)
-                    if avail >= needed_cap_hrs:
-                        actual_start_dt = check_dt
-                        found_capacity = True
-                        break
+                res_cap = transient_resource_capacity[res_id]
+                actual_idx = find_capacity_slot(res_cap, req_start_day, needed_cap_hrs, max_lookback)
                 
-                if found_capacity:
-                    actual_str = actual_start_dt.strftime('%Y-%m-%d')
-                    transient_resource_capacity[res_id][actual_str] -= needed_cap_hrs
-                    planned_orders.append({
-                        "id": f"PO-{item_id}-{len(planned_orders)}", "item": item_id, "qty": round(unmet, 4), "type": "Production", 
-                        "start": actual_str, "finish": due_date_str, "res": res_id, "lt_days": lt_days, "supplier": "Internal"
-                    })
-                    if due_date_str in mrp_plan[item_id]: mrp_plan[item_id][due_date_str]['inflow_fresh'] += unmet
+                if actual_idx >= 0:
+                    res_cap[actual_idx] -= needed_cap_hrs
+                    planned_orders.append((item_id, unmet, "Production", actual_idx, due_day, res_id, lt_days, "Internal", 0, "N/A"))
+                    if due_idx is not None: mrp[INFLOW_FRESH, row, due_idx] += unmet
                     steps.append({"action": "Production", "msg": f"Scheduled on {res_id}", "item": item_id, "qty": round(unmet, 4)})
                     unmet = 0
                 else:
                     steps.append({"action": "Infeasible", "reason": "Capacity Bottleneck", "item": item_id, "resource": res_id})
-                    if due_date_str in mrp_plan[item_id]: mrp_plan[item_id][due_date_str]['shortage'] += unmet
+                    if due_idx is not None: mrp[SHORTAGE, row, due_idx] += unmet
             else:
-                planned_orders.append({"id": f"PO-{item_id}-{len(planned_orders)}", "item": item_id, "qty": round(unmet, 4), "type": "Production", "start": req_start_str, "finish": due_date_str, "lt_days": lt_days, "supplier": "Internal"})
-                if due_date_str in mrp_plan[item_id]: mrp_plan[item_id][due_date_str]['inflow_fresh'] += unmet
+                planned_orders.append((item_id, unmet, "Production", req_start_day, due_day, None, lt_days, "Internal", 0, "N/A"))
+                if due_idx is not None: mrp[INFLOW_FRESH, row, due_idx] += unmet
                 steps.append({"action": "Production", "msg": "Scheduled (Unconstrained)", "item": item_id, "qty": round(unmet, 4)})
                 unmet = 0
         else:
             # BUY LOGIC WITH LOT SIZING & FINANCIALS
-            item_suppliers = supplier_master[supplier_master['itemid'] == item_id] if supplier_master is not None else pd.DataFrame()
-            if item_suppliers.empty:
-                lt_days = int(pd.to_numeric(item_row.get('leadtimebuy', 7), errors='coerce'))
-                req_start_str = (datetime.strptime(due_date_str, '%Y-%m-%d') - timedelta(days=lt_days)).strftime('%Y-%m-%d')
-                planned_orders.append({"id": f"PUR-{item_id}-{len(planned_orders)}", "item": item_id, "qty": round(unmet, 4), "type": "Purchase", "start": req_start_str, "finish": due_date_str, "lt_days": lt_days, "supplier": "Unknown", "rate": 0, "total_cost": 0, "buyer_code": "N/A"})
-                if due_date_str in mrp_plan[item_id]: mrp_plan[item_id][due_date_str]['inflow_fresh'] += unmet
+            k = meta.sup_key
+            if k is None:
+                lt_days = meta.lt_buy
+                planned_orders.append((item_id, unmet, "Purchase", due_day - lt_days, due_day, None, lt_days, "Unknown", 0, "N/A"))
+                if due_idx is not None: mrp[INFLOW_FRESH, row, due_idx] += unmet
                 steps.append({"action": "Purchase", "msg": "Ordered (Default Supplier)", "item": item_id, "qty": round(unmet, 4)})
                 unmet = 0
             else:
-                sorted_sups = item_suppliers.sort_values(by='sharepercent', ascending=False)
                 original_unmet = unmet
-                for _, s_row in sorted_sups.iterrows():
+                for sup in range(sup_offsets[k], sup_offsets[k + 1]):
                     if unmet <= 0: break
                     
                     # Consume surplus stock from lot sizing of previous orders
@@ -236,87 +383,83 @@ def run_solver(data, horizon, start_date, is_constrained, build_ahead):
                         steps.append({"action": "Stock", "msg": f"Used {round(consumed, 4)} surplus", "qty": round(consumed, 4), "item": item_id})
                         if unmet <= 0: break
 
-                    s_id = str(s_row.get('supplierid', s_row.get('suppliername', 'Unknown')))
-                    s_name = str(s_row.get('suppliername', s_id))
-                    share = pd.to_numeric(s_row.get('sharepercent', 1.0), errors='coerce')
-                    lt_days = int(pd.to_numeric(s_row.get('leadtimedays', 7), errors='coerce'))
+                    s_id, s_name = sup_ids[sup], sup_names[sup]
+                    share, lt_days = sup_share[sup], sup_lt[sup]
                     
                     # New Columns Logic
-                    lot_size = pd.to_numeric(s_row.get('supplierlotsize', 0), errors='coerce') or 0
-                    lot_inc = pd.to_numeric(s_row.get('supplierlotincrement', 0), errors='coerce') or 0
-                    rate = pd.to_numeric(s_row.get('rateperunit', 0), errors='coerce') or 0
-                    buyer_code = str(s_row.get('buyercode', 'N/A'))
+                    lot_size, lot_inc = sup_lot_size[sup], sup_lot_inc[sup]
+                    rate, buyer_code = sup_rate[sup], sup_buyer[sup]
                     
-                    cap_key = f"{s_id}_{item_id}"
-                    target_for_sup = original_unmet * share
-                    sup_allocated = 0
-                    lookback = 15 if build_ahead else 1
-                    curr_dt = datetime.strptime(due_date_str, '%Y-%m-%d')
-                    
-                    for lb in range(lookback):
-                        d_str = (curr_dt - timedelta(days=lb)).strftime('%Y-%m-%d')
-                        if d_str not in transient_supplier_capacity.get(cap_key, {}): continue
+                    sup_cap = transient_supplier_capacity.get((s_id, item_id))
+                    if sup_cap is None: continue
+                    n = book_supplier_days(sup_cap, due_day, lookback, original_unmet * share, unmet, lot_size, lot_inc, book_days, book_qtys)
+                    for d_idx, final_qty in zip(book_days[:n].tolist(), book_qtys[:n].tolist()):
+                        # Surplus management
+                        satisfied_now = min(final_qty, unmet)
+                        surplus = final_qty - satisfied_now
+                        if surplus > 0:
+                            transient_stock[item_id] = transient_stock.get(item_id, 0) + surplus
                         
-                        avail = transient_supplier_capacity[cap_key][d_str]
-                        base_req = min(target_for_sup - sup_allocated, unmet)
-                        if base_req <= 0: break
-
-                        # Lot Sizing Calculation
-                        order_qty = apply_lot_sizing(base_req, lot_size, lot_inc)
-                        final_qty = min(order_qty, avail)
+                        planned_orders.append((item_id, final_qty, "Purchase", d_idx - lt_days, d_idx, None, lt_days, s_name, rate, buyer_code))
+                        if d_idx < len(plan_dates): mrp[INFLOW_FRESH, row, d_idx] += final_qty
                         
-                        if final_qty > 0:
-                            transient_supplier_capacity[cap_key][d_str] -= final_qty
-                            
-                            # Surplus management
-                            satisfied_now = min(final_qty, unmet)
-                            surplus = final_qty - satisfied_now
-                            if surplus > 0:
-                                transient_stock[item_id] = transient_stock.get(item_id, 0) + surplus
-                            
-                            p_start = (datetime.strptime(d_str, '%Y-%m-%d') - timedelta(days=lt_days)).strftime('%Y-%m-%d')
-                            planned_orders.append({
-                                "id": f"PUR-{item_id}-{len(planned_orders)}", 
-                                "item": item_id, "qty": round(final_qty, 4), "type": "Purchase", 
-                                "start": p_start, "finish": d_str, "supplier": s_name, "lt_days": lt_days,
-                                "rate": rate, "total_cost": round(final_qty * rate, 2), "buyer_code": buyer_code
-                            })
-                            if d_str in mrp_plan[item_id]: mrp_plan[item_id][d_str]['inflow_fresh'] += final_qty
-                            
-                            unmet -= satisfied_now
-                            sup_allocated += satisfied_now
-                            steps.append({"action": "Purchase", "msg": f"Ordered {round(final_qty, 4)} from {s_name}", "item": item_id, "qty": round(final_qty, 4)})
-                        
-                        if sup_allocated >= target_for_sup or unmet <= 0: break
+                        unmet -= satisfied_now
+                        steps.append({"action": "Purchase", "msg": f"Ordered {round(final_qty, 4)} from {s_name}", "item": item_id, "qty": round(final_qty, 4)})
 
                 if unmet > 0:
                     steps.append({"action": "Infeasible", "reason": "Supplier Capacity Shortage", "item": item_id, "qty": round(unmet, 4)})
-                    if due_date_str in mrp_plan[item_id]: mrp_plan[item_id][due_date_str]['shortage'] += unmet
-        return unmet
+                    if due_idx is not None: mrp[SHORTAGE, row, due_idx] += unmet
+        return children
+
+    def explode(item_id, qty, due_day, steps):
+        """Resolves a demand line level by level (BFS), merging equal (item, due day) requirements per level.
+
+        Requirements for unmerged_items keep one entry per parent, in parent order.
+        """
+        level, is_direct, depth = {(item_id, due_day): qty}, True, 0
+        while level:
+            if depth > len(bom_index):
+                raise ValueError(f"BOM cycle detected below item {item_id}")
+            next_level = defaultdict(float)
+            for (l_item, l_due, *_), l_qty in level.items():
+                for c_id, c_qty, c_due in resolve(l_item, l_qty, l_due, steps, is_direct):
+                    # A fresh key per requirement: the level's size only grows, so it never repeats
+                    key = (c_id, c_due, len(next_level)) if c_id in unmerged_items else (c_id, c_due)
+                    next_level[key] += c_qty
+            level, is_direct, depth = next_level, False, depth + 1
 
     # 5. Demand Loop
-    for _, order in sorted_demand.iterrows():
-        item_id = str(order['itemid']).strip().upper()
-        trace = {"order_id": str(order.get('scheduleno', 'SO')), "item": item_id, "qty": order['demandqty'], "due": str(order['duedate_clean']), "steps": [], "logs": []}
-        resolve(trace['item'], float(order['demandqty']), trace['due'], trace['steps'], trace['logs'], True, 0)
+    # Pull the sorted columns out once and walk them in lockstep
+    orders = zip(str_col(sorted_demand, 'scheduleno', 'SO'), str_col(sorted_demand, 'itemid', ''),
+                 sorted_demand['demandqty'].tolist(), str_col(sorted_demand, 'duedate_clean', ''),
+                 sorted_demand['due_day'].tolist()) if demand is not None else ()
+    # Each order is planned on its own: merging orders would book capacity and lead time
+    # for the summed quantity, which can fail where the separate orders fit
+    for order_id, item_id, qty, due, due_day in orders:
+        trace = {"order_id": order_id, "item": item_id.strip().upper(), "qty": qty, "due": due, "steps": [], "logs": []}
+        explode(trace['item'], float(qty), int(due_day), trace['steps'])
         demand_trace.append(trace)
 
     # 6. Inventory Roll
-    for item in mrp_plan:
-        running_stock = 0
-        for d in sorted(mrp_plan[item].keys()):
-            bucket = mrp_plan[item][d]
-            bucket['starting_stock'] = round(running_stock, 4)
-            inflows = bucket['inflow_fresh'] + bucket['inflow_onhand']
-            outflows = bucket['outflow_dep'] + bucket['outflow_direct']
-            net = running_stock + inflows - outflows
-            bucket['ending_stock'] = round(max(0, net), 4)
-            if net < 0 and bucket['shortage'] == 0:
-                bucket['shortage'] = round(abs(net), 4)
-            running_stock = bucket['ending_stock']
+    plan = mrp[:, :len(item_index)]
+    net_flow = plan[INFLOW_FRESH] + plan[INFLOW_ONHAND] - plan[OUTFLOW_DEP] - plan[OUTFLOW_DIRECT]
+    cum_flow = np.cumsum(net_flow, axis=1)
+    # Stock is floored at zero every day: ending = cumsum - running min(0, cumsum)
+    ending = cum_flow - np.minimum.accumulate(np.minimum(cum_flow, 0), axis=1)
+    starting = np.zeros_like(ending)
+    starting[:, 1:] = ending[:, :-1]
+    net = starting + net_flow
+    plan[STARTING_STOCK] = np.round(starting, 4)
+    plan[ENDING_STOCK] = np.round(ending, 4)
+    plan[SHORTAGE] = np.where((net < 0) & (plan[SHORTAGE] == 0), np.round(-net, 4), plan[SHORTAGE])
+
+    # Expand to the {item: {date: {field: value}}} shape only for the response
+    buckets = plan.transpose(1, 2, 0).tolist()
+    mrp_plan = {item_id: {d: dict(zip(MRP_FIELDS, b)) for d, b in zip(plan_dates, item_buckets)}
+                for item_id, item_buckets in zip(item_index, buckets)}
 
     return {
-        "planned_orders": planned_orders,
+        "planned_orders": [order_record(i, order) for i, order in enumerate(planned_orders)],
         "mrp": mrp_plan,
         "trace": demand_trace,
         "system_logs": system_logs,
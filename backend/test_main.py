@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Demand.csv", "demand"),
+    ("Item Master", "items"),
+    ("Supplier_Master", "supplier_master"),
+    # The longer token wins: "resource routing" is not plain routing
+    ("Resource Routing", "resource_routing"),
+    ("Routing", "routing"),
+    # Ties go to the earlier mapping: a product structure is a BOM, not the item list
+    ("Product Structure", "bom"),
+    ("notes", None),
+])
+def test_match_key(name, key):
+    assert main.match_key(name) == key
+
+
+def test_to_records_maps_missing_values_to_none():
+    df = pd.DataFrame({"qty": [1.5, np.nan], "item": ["A", None]})
+
+    assert main.to_records(df) == [{"qty": 1.5, "item": "A"}, {"qty": None, "item": None}]
+    assert main.to_records(None) == []
+
+
+def test_to_records_falls_back_for_mixed_columns():
+    # Arrow cannot type a column mixing ints and strings
+    df = pd.DataFrame({"value": [1, "x", np.nan]})
+
+    assert main.to_records(df) == [{"value": 1}, {"value": "x"}, {"value": None}]
+
+
+@pytest.mark.parametrize("use_arrow", [True, False])
+def test_blank_csv_rows_are_dropped(monkeypatch, use_arrow):
+    if not use_arrow:
+        monkeypatch.setattr(main, "pacsv", None)
+    # Excel CSV exports often end in rows of bare separators
+    demand = b"Item ID,Demand Qty,Due Date,Demand Priority\nFG,10,2025-12-05,1\n,,,\n"
+
+    r = client.post("/solve", data={"horizon": 10, "start_date": "2025-12-01"},
+                    files=[("files", ("demand.csv", demand, "text/csv"))])
+
+    assert r.status_code == 200, r.text
+    assert [t["item"] for t in r.json()["trace"]] == ["FG"]
@@ -0,0 +1,102 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from solver_engine import run_solver
+
+START = date(2025, 12, 1)
+
+
+def solve(items, bom, demand):
+    data = {"items": pd.DataFrame(items), "bom": pd.DataFrame(bom), "demand": pd.DataFrame(demand)}
+    return run_solver(data, 10, START, False, False)
+
+
+def test_shared_component_is_planned_once_per_level():
+    # FG is built from A and B, and both use one C: C's two requirements share a due day
+    items = {"ItemID": ["FG", "A", "B", "C"], "MakeBuy": ["make", "make", "make", "buy"], "LeadTimeBuy": [0, 0, 0, 0]}
+    bom = {"ParentID": ["FG", "FG", "A", "B"], "ChildID": ["A", "B", "C", "C"], "QtyPer": [1, 1, 2, 3]}
+    demand = {"ItemID": ["FG"], "DemandQty": [10], "DueDate": ["2025-12-05"]}
+
+    result = solve(items, bom, demand)
+
+    c_orders = [o for o in result["planned_orders"] if o["item"] == "C"]
+    assert [(o["qty"], o["finish"]) for o in c_orders] == [(50, "2025-12-05")]
+    assert result["mrp"]["C"]["2025-12-05"]["outflow_dep"] == 50
+    assert [s["item"] for s in result["trace"][0]["steps"]] == ["FG", "A", "B", "C"]
+
+
+def test_bom_cycle_raises():
+    items = {"ItemID": ["A", "B"], "MakeBuy": ["make", "make"]}
+    bom = {"ParentID": ["A", "B"], "ChildID": ["B", "A"], "QtyPer": [1, 1]}
+    demand = {"ItemID": ["A"], "DemandQty": [1], "DueDate": ["2025-12-05"]}
+
+    with pytest.raises(ValueError, match="BOM cycle"):
+        solve(items, bom, demand)
+
+
+def test_stock_quantities_keep_integers():
+    data = {
+        "items": pd.DataFrame({"ItemID": ["FG"], "MakeBuy": ["make"]}),
+        "supplies": pd.DataFrame({"ItemID": ["FG"], "FG": [8]}),
+        "demand": pd.DataFrame({"ItemID": ["FG"], "DemandQty": [10], "DueDate": ["2025-12-05"]}),
+    }
+
+    steps = run_solver(data, 10, START, False, False)["trace"][0]["steps"]
+
+    assert (steps[0]["msg"], steps[0]["qty"]) == ("Consumed 8 units", 8)
+
+
+def test_orders_sharing_item_and_day_keep_their_own_steps():
+    data = {
+        "items": pd.DataFrame({"ItemID": ["FG"], "MakeBuy": ["buy"]}),
+        "supplies": pd.DataFrame({"ItemID": ["FG"], "FG": [10]}),
+        "supplier_master": pd.DataFrame({"SupplierID": ["S1"], "SupplierName": ["S1"], "ItemID": ["FG"], "SharePercent": [1],
+                                         "LeadTimeDays": [1], "SupplierCapacityPerDay": [0.001]}),
+        "demand": pd.DataFrame({"ScheduleNo": ["SO1", "SO2"], "ItemID": ["FG", "FG"], "DemandQty": [10, 10],
+                                "DueDate": ["2025-12-05", "2025-12-05"], "DemandPriority": [1, 1]}),
+    }
+
+    so1, so2 = run_solver(data, 10, START, True, False)["trace"]
+
+    assert [(s["action"], s.get("msg"), s["qty"]) for s in so1["steps"]] == [("Stock", "Consumed 10.0 units", 10.0)]
+    assert [(s["action"], s.get("msg") or s.get("reason"), s["qty"]) for s in so2["steps"]] == [
+        ("Purchase", "Ordered 0.001 from S1", 0.001),
+        ("Infeasible", "Supplier Capacity Shortage", 9.999),
+    ]
+
+
+def test_constrained_orders_sharing_item_and_day_are_booked_separately():
+    # 10 units take 5 h of an 8 h/day resource: each order fits a day, the two together do not
+    data = {
+        "items": pd.DataFrame({"ItemID": ["FG"], "MakeBuy": ["make"]}),
+        "resource_routing": pd.DataFrame({"Item": ["FG"], "ResourceID": ["R1"], "DailyCapacity": [8], "NoOfMachines": [1],
+                                          "CapacityConsumedPer": [1800]}),
+        "demand": pd.DataFrame({"ScheduleNo": ["SO1", "SO2"], "ItemID": ["FG", "FG"], "DemandQty": [10, 10],
+                                "DueDate": ["2025-12-10", "2025-12-10"], "DemandPriority": [1, 1]}),
+    }
+
+    result = run_solver(data, 15, START, True, True)
+
+    assert [(o["item"], o["qty"], o["start"]) for o in result["planned_orders"]] == [
+        ("FG", 10, "2025-12-10"), ("FG", 10, "2025-12-09"),
+    ]
+    assert not any(s["action"] == "Infeasible" for t in result["trace"] for s in t["steps"])
+
+
+def test_constrained_shared_component_is_booked_per_parent():
+    # A and B each need 10 C; 10 C take 5 h of an 8 h/day resource, so 20 C never fit one day
+    data = {
+        "items": pd.DataFrame({"ItemID": ["FG", "A", "B", "C"], "MakeBuy": ["make"] * 4}),
+        "bom": pd.DataFrame({"ParentID": ["FG", "FG", "A", "B"], "ChildID": ["A", "B", "C", "C"], "QtyPer": [1, 1, 10, 10]}),
+        "resource_routing": pd.DataFrame({"Item": ["C"], "ResourceID": ["R1"], "DailyCapacity": [8], "NoOfMachines": [1],
+                                          "CapacityConsumedPer": [1800]}),
+        "demand": pd.DataFrame({"ItemID": ["FG"], "DemandQty": [1], "DueDate": ["2025-12-10"]}),
+    }
+
+    result = run_solver(data, 15, START, True, True)
+
+    c_orders = [(o["qty"], o["start"]) for o in result["planned_orders"] if o["item"] == "C"]
+    assert c_orders == [(10, "2025-12-10"), (10, "2025-12-09")]
+    assert not any(s["action"] == "Infeasible" for s in result["trace"][0]["steps"])